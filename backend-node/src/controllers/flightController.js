@@ -97,6 +97,15 @@ const searchFlights = async (req, res) => {
     }
     query.destination = destAirport._id;
 
+    // Count this route search once, however many flights it returns
+    axios
+      .post(`${PYTHON_PRICING_URL}/api/search-events`, {
+        origin: originAirport.iata,
+        destination: destAirport.iata,
+        searcherId: req.ip,
+      })
+      .catch((error) => console.warn(`⚠️ Failed to record search event: ${error.message}`));
+
     console.log(`Query: ${JSON.stringify(query)}`);
 
     let flights = await Flight.find(query)
@@ -118,6 +127,7 @@ const searchFlights = async (req, res) => {
           totalSeats: flight.totalSeats,
           availableSeats: flight.availableSeats,
           departureTime: flight.departureTime,
+          searcherId: req.ip,
         });
 
         if (response.data && response.data.price) {
@@ -39,8 +39,9 @@ class PriceResponse(BaseModel):
     demandLevel: str
     bookingCount: int
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 import os
@@ -50,12 +51,30 @@ from apscheduler.schedulers.background import BackgroundScheduler
 import json
 import random
 import math
+import csv
+import io
+import base64
+import asyncio
+import time
+import hashlib
+import hmac
+import sys
+import re
+from array import array
+from urllib.parse import quote
 from typing import List, Dict, Optional
 from enum import Enum
+from contextlib import asynccontextmanager
 
 load_dotenv()
 
-app = FastAPI(title="Flight Booking Dynamic Pricing Engine")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Release pooled connections to the booking backend
+    await flight_data_client.close()
+
+app = FastAPI(title="Flight Booking Dynamic Pricing Engine", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -74,6 +93,14 @@ events_db = {}  # Event-aware pricing
 fraud_alerts = []  # Fraud detection
 forecast_data = {}  # Demand forecasting
 
+BOOKING_BACKEND_URL = os.getenv('BOOKING_BACKEND_URL', 'http://localhost:5000/api')
+FLIGHT_CACHE_TTL = float(os.getenv('FLIGHT_CACHE_TTL', '60'))  # Seconds
+SEARCH_WINDOW_SECONDS = int(os.getenv('SEARCH_WINDOW_SECONDS', '3600'))
+SEARCH_SKETCH_WIDTH = int(os.getenv('SEARCH_SKETCH_WIDTH', '1024'))
+SEARCH_SKETCH_DEPTH = int(os.getenv('SEARCH_SKETCH_DEPTH', '4'))
+SEARCH_HLL_PRECISION = int(os.getenv('SEARCH_HLL_PRECISION', '12'))
+SKETCH_MERGE_TOKEN = os.getenv('SKETCH_MERGE_TOKEN')  # Shared secret between workers; unset disables merging
+
 class DemandLevel(str, Enum):
     LOW = "low"
     MEDIUM = "medium"
@@ -95,6 +122,7 @@ class PriceRequest(BaseModel):
     userId: Optional[str] = None
     searchCount: Optional[int] = 0
     isGroupBooking: Optional[bool] = False
+    searcherId: Optional[str] = None  # Network identity (client IP); only used for unique-searcher estimates
 
 class PriceResponse(BaseModel):
     price: float
@@ -112,11 +140,519 @@ class EventData(BaseModel):
     endDate: str
     location: str
 
+class SearchEvent(BaseModel):
+    origin: str  # IATA codes
+    destination: str
+    searcherId: Optional[str] = None
+
+class PriceRefreshRequest(BaseModel):
+    flightIds: List[str]
+
 class WhatIfScenario(BaseModel):
     scenario: str  # "fuel_increase", "half_empty", "competitor_price_drop"
     value: float
     flightId: str
 
+FLIGHT_ID_PATTERN = re.compile(r'[0-9a-fA-F]{24}')  # MongoDB ObjectId
+
+def is_flight_id(flight_id: str) -> bool:
+    return bool(FLIGHT_ID_PATTERN.fullmatch(flight_id))
+
+class FlightDataClient:
+    """
+    Fetches flight records from the booking backend over a shared, pooled
+    httpx.AsyncClient. Lookups are served from a TTL cache, and concurrent
+    lookups of the same flight share a single upstream request.
+    """
+
+    def __init__(self, base_url: str, ttl: float = 60, max_connections: int = 20,
+                 max_keepalive: int = 10, timeout: float = 5.0, max_cached: int = 2048,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self._limits = httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_keepalive)
+        self._timeout = timeout
+        self._transport = transport  # Lets tests point at a local stand-in server
+        self._client: Optional[httpx.AsyncClient] = None
+        self._cache: Dict[str, tuple] = {}  # flight_id -> (expires_at, record)
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=self._limits,
+                timeout=self._timeout,
+                transport=self._transport
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._inflight.clear()
+
+    def invalidate(self, flight_id: Optional[str] = None):
+        """Drop one cached flight, or the whole cache"""
+        if flight_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(flight_id, None)
+
+    async def get_flight(self, flight_id: str) -> Optional[Dict]:
+        """
+        Return the normalized flight record, or None if the id is malformed or
+        the backend has no such flight. Raises httpx.HTTPError when the backend
+        cannot be reached or fails.
+        """
+        if not is_flight_id(flight_id):
+            return None
+
+        cached = self._cache.get(flight_id)
+        if cached:
+            if cached[0] > time.monotonic():
+                return cached[1]
+            del self._cache[flight_id]
+
+        task = self._inflight.get(flight_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(flight_id))
+            self._inflight[flight_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(flight_id, None))
+
+        # Shield so one caller giving up does not cancel the shared request
+        return await asyncio.shield(task)
+
+    async def get_flights(self, flight_ids: List[str]) -> Dict[str, Dict]:
+        """Fetch many flights concurrently; unknown ids are left out of the result"""
+        unique_ids = list(dict.fromkeys(flight_ids))
+        records = await asyncio.gather(*(self.get_flight(flight_id) for flight_id in unique_ids))
+        return {
+            flight_id: record
+            for flight_id, record in zip(unique_ids, records)
+            if record is not None
+        }
+
+    async def _fetch(self, flight_id: str) -> Optional[Dict]:
+        response = await self.client.get(f"/flights/{quote(flight_id, safe='')}")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+
+        record = self._normalize(flight_id, response.json())
+        self._store(flight_id, record)
+        return record
+
+    def _store(self, flight_id: str, record: Dict):
+        now = time.monotonic()
+        self._cache.pop(flight_id, None)  # Re-insert so dict order tracks expiry
+        if len(self._cache) >= self.max_cached:
+            # Entries are in expiry order: drop expired ones, then the oldest if still full
+            for key in [key for key, (expires_at, _) in self._cache.items() if expires_at <= now]:
+                del self._cache[key]
+            while len(self._cache) >= self.max_cached:
+                del self._cache[next(iter(self._cache))]
+        self._cache[flight_id] = (now + self.ttl, record)
+
+    @staticmethod
+    def _normalize(flight_id: str, raw: Dict) -> Dict:
+        # The booking backend replaces availableSeats with the list of open seat numbers
+        available_seats = raw.get('availableSeats', 0)
+        if isinstance(available_seats, list):
+            available_seats = len(available_seats)
+
+        def airport_code(airport):
+            return airport.get('iata') if isinstance(airport, dict) else airport
+
+        return {
+            'flightId': str(raw.get('_id', flight_id)),
+            'flightNumber': raw.get('flightNumber'),
+            'origin': airport_code(raw.get('origin')),
+            'destination': airport_code(raw.get('destination')),
+            'baseFare': float(raw['baseFare']),
+            'totalSeats': int(raw['totalSeats']),
+            'availableSeats': int(available_seats),
+            'departureTime': raw['departureTime']
+        }
+
+flight_data_client = FlightDataClient(BOOKING_BACKEND_URL, ttl=FLIGHT_CACHE_TTL)
+
+def booking_backend_error(e: httpx.HTTPError, flight_id: str) -> HTTPException:
+    """Map a failed flight lookup to the error this service reports"""
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        print(f"❌ Booking backend returned {status} for flight {flight_id}")
+        if status == 429:
+            return HTTPException(status_code=503, detail="Booking backend rate limit reached")
+        return HTTPException(status_code=502, detail="Booking backend error")
+
+    print(f"❌ Failed to reach booking backend for flight {flight_id}: {str(e)}")
+    return HTTPException(status_code=502, detail="Booking backend unavailable")
+
+def pricing_fields(flight_record: Dict) -> Dict:
+    """The PriceRequest fields of a flight record"""
+    return {
+        'flightId': flight_record['flightId'],
+        'baseFare': flight_record['baseFare'],
+        'totalSeats': flight_record['totalSeats'],
+        'availableSeats': flight_record['availableSeats'],
+        'departureTime': flight_record['departureTime']
+    }
+
+def sketch_hash(value: str) -> tuple:
+    """
+    Two independent 64-bit hashes of a key. Uses blake2b rather than hash() so
+    sketches built by different worker processes agree and can be merged.
+    """
+    digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+def pack_array(values: array) -> str:
+    """Serialize a numeric array as little-endian base64"""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode()
+
+def unpack_array(typecode: str, payload: str) -> array:
+    values = array(typecode)
+    values.frombytes(base64.b64decode(payload))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+CMS_MAX_COUNT = 2 ** 32 - 1  # Counters saturate rather than overflow array('I')
+
+class CountMinSketch:
+    """
+    Fixed-size frequency sketch. Estimates never undercount, and overcount by
+    at most epsilon * total with probability 1 - delta.
+    """
+
+    def __init__(self, width: int = 1024, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.table = array('I', bytes(4 * width * depth))
+
+    def _cells(self, key: str):
+        h1, h2 = sketch_hash(key)
+        # Kirsch-Mitzenmacher: derive one column per row from two base hashes
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, key: str, count: int = 1):
+        for cell in self._cells(key):
+            self.table[cell] = min(self.table[cell] + count, CMS_MAX_COUNT)
+        self.total += count
+
+    def estimate(self, key: str) -> int:
+        return min(self.table[cell] for cell in self._cells(key))
+
+    def clear(self):
+        self.table = array('I', bytes(4 * self.width * self.depth))
+        self.total = 0
+
+    @property
+    def layout(self) -> Dict:
+        return {'width': self.width, 'depth': self.depth}
+
+    def merge(self, other: 'CountMinSketch'):
+        if self.layout != other.layout:
+            raise ValueError("Cannot merge count-min sketches of different dimensions")
+        for cell, count in enumerate(other.table):
+            self.table[cell] = min(self.table[cell] + count, CMS_MAX_COUNT)
+        self.total += other.total
+
+    @property
+    def epsilon(self) -> float:
+        return math.e / self.width
+
+    @property
+    def delta(self) -> float:
+        return math.exp(-self.depth)
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.table.itemsize * len(self.table)
+
+    def to_dict(self) -> Dict:
+        return {'width': self.width, 'depth': self.depth, 'total': self.total, 'table': pack_array(self.table)}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'CountMinSketch':
+        sketch = cls(int(data['width']), int(data['depth']))
+        table = unpack_array('I', data['table'])
+        if len(table) != len(sketch.table):
+            raise ValueError("Count-min table does not match its dimensions")
+
+        # Every add touches one cell per row, so each row must sum to the total
+        total = int(data['total'])
+        width = sketch.width
+        if any(sum(table[row * width:(row + 1) * width]) != total for row in range(sketch.depth)):
+            raise ValueError("Count-min rows do not add up to the sketch total")
+
+        sketch.table = table
+        sketch.total = total
+        return sketch
+
+class HyperLogLog:
+    """Fixed-size cardinality sketch with standard error 1.04 / sqrt(2^precision)"""
+
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: str):
+        h, _ = sketch_hash(value)
+        index = h >> (64 - self.precision)
+        remainder = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        m = len(self.registers)
+        # Bias-correction constants from Flajolet et al.; the formula only holds for m >= 128
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction: fall back to linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def clear(self):
+        self.registers = bytearray(len(self.registers))
+
+    @property
+    def layout(self) -> Dict:
+        return {'precision': self.precision}
+
+    def merge(self, other: 'HyperLogLog'):
+        if self.layout != other.layout:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    @property
+    def standard_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.registers)
+
+    def to_dict(self) -> Dict:
+        return {'precision': self.precision, 'registers': base64.b64encode(bytes(self.registers)).decode()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'HyperLogLog':
+        sketch = cls(int(data['precision']))
+        registers = bytearray(base64.b64decode(data['registers']))
+        if len(registers) != len(sketch.registers):
+            raise ValueError("HyperLogLog registers do not match its precision")
+        if registers and max(registers) > 64 - sketch.precision + 1:
+            raise ValueError("HyperLogLog register exceeds the maximum rank")
+        sketch.registers = registers
+        return sketch
+
+class SlidingWindowSketch:
+    """
+    Ring of sketches, one per time bucket, covering the last window_seconds.
+    Buckets are keyed by wall-clock epoch so rings from different workers line
+    up when merged. Memory is fixed at `buckets` sketches.
+    """
+
+    def __init__(self, factory, window_seconds: int = 3600, buckets: int = 12):
+        self.factory = factory
+        self.window_seconds = window_seconds
+        self.bucket_seconds = window_seconds / buckets
+        self.sketches = [factory() for _ in range(buckets)]
+        self.epochs = [-1] * buckets
+
+    def _epoch(self, now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // self.bucket_seconds)
+
+    def current(self, now: Optional[float] = None):
+        epoch = self._epoch(now)
+        slot = epoch % len(self.sketches)
+        if self.epochs[slot] != epoch:
+            self.sketches[slot].clear()
+            self.epochs[slot] = epoch
+        return self.sketches[slot]
+
+    def live(self, now: Optional[float] = None) -> list:
+        current = self._epoch(now)
+        oldest = current - len(self.sketches)
+        return [sketch for sketch, epoch in zip(self.sketches, self.epochs) if oldest < epoch <= current]
+
+    def check_compatible(self, other: 'SlidingWindowSketch'):
+        """Raise ValueError unless every slot of other can merge into this window"""
+        if (self.window_seconds, len(self.sketches)) != (other.window_seconds, len(other.sketches)):
+            raise ValueError("Cannot merge sliding windows with different layouts")
+        layout = self.sketches[0].layout
+        if any(type(sketch) is not type(self.sketches[0]) or sketch.layout != layout for sketch in other.sketches):
+            raise ValueError("Cannot merge sliding windows holding different sketch layouts")
+
+    def merge(self, other: 'SlidingWindowSketch', now: Optional[float] = None):
+        # Validate everything up front so a rejected merge leaves this window untouched
+        self.check_compatible(other)
+
+        oldest = self._epoch(now) - len(self.sketches)
+        for slot, (sketch, epoch) in enumerate(zip(other.sketches, other.epochs)):
+            if epoch <= oldest or epoch < self.epochs[slot]:
+                continue
+            if epoch > self.epochs[slot]:
+                self.sketches[slot].clear()
+                self.epochs[slot] = epoch
+            self.sketches[slot].merge(sketch)
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(sketch.memory_bytes for sketch in self.sketches)
+
+    def to_dict(self) -> Dict:
+        return {
+            'windowSeconds': self.window_seconds,
+            'epochs': list(self.epochs),
+            'sketches': [sketch.to_dict() for sketch in self.sketches]
+        }
+
+    def load(self, data: Dict) -> 'SlidingWindowSketch':
+        """Build a window with this window's layout from a to_dict() payload"""
+        if (int(data['windowSeconds']) != self.window_seconds
+                or len(data['sketches']) != len(self.sketches)
+                or len(data['epochs']) != len(self.sketches)):
+            raise ValueError("Sliding window snapshot does not match this layout")
+
+        # Check dimensions before from_dict allocates anything sized by the payload
+        layout = self.sketches[0].layout
+        for sketch in data['sketches']:
+            if {key: int(sketch[key]) for key in layout} != layout:
+                raise ValueError("Sliding window snapshot does not match this sketch layout")
+
+        epochs = [int(epoch) for epoch in data['epochs']]
+        if max(epochs) > self._epoch():
+            raise ValueError("Sliding window snapshot has buckets from the future")
+
+        window = SlidingWindowSketch(self.factory, self.window_seconds, len(self.sketches))
+        sketch_cls = type(self.sketches[0])
+        window.sketches = [sketch_cls.from_dict(sketch) for sketch in data['sketches']]
+        window.epochs = epochs
+        return window
+
+class SearchTrafficMonitor:
+    """
+    Server-side view of search traffic: windowed count-min counts per flight
+    (one per price quote) and per route (one per search), plus windowed
+    HyperLogLog unique searchers.
+    """
+
+    def __init__(self, window_seconds: int = 3600, buckets: int = 12, width: int = 1024,
+                 depth: int = 4, precision: int = 12):
+        self.counts = SlidingWindowSketch(lambda: CountMinSketch(width, depth), window_seconds, buckets)
+        self.searchers = SlidingWindowSketch(lambda: HyperLogLog(precision), window_seconds, buckets)
+
+    def record_search(self, flight_id: str, searcher_id: Optional[str] = None):
+        """Record that a flight was quoted in search results"""
+        self.counts.current().add(f'flight:{flight_id}')
+        if searcher_id:
+            self.searchers.current().add(searcher_id)
+
+    def record_route_search(self, origin: str, destination: str, searcher_id: Optional[str] = None):
+        """Record one search of a route, however many flights it returned"""
+        self.counts.current().add(f'route:{origin.upper()}-{destination.upper()}')
+        if searcher_id:
+            self.searchers.current().add(searcher_id)
+
+    def _estimate(self, key: str) -> int:
+        return sum(sketch.estimate(key) for sketch in self.counts.live())
+
+    def flight_searches(self, flight_id: str) -> int:
+        return self._estimate(f'flight:{flight_id}')
+
+    def route_searches(self, origin: str, destination: str) -> int:
+        return self._estimate(f'route:{origin.upper()}-{destination.upper()}')
+
+    def unique_searchers(self) -> int:
+        live = self.searchers.live()
+        if not live:
+            return 0
+        union = HyperLogLog(live[0].precision)
+        for sketch in live:
+            union.merge(sketch)
+        return union.count()
+
+    def total_events(self) -> int:
+        return sum(sketch.total for sketch in self.counts.live())
+
+    def stats(self) -> Dict:
+        cms = self.counts.sketches[0]
+        hll = self.searchers.sketches[0]
+        total = self.total_events()
+        return {
+            'windowSeconds': self.counts.window_seconds,
+            'buckets': len(self.counts.sketches),
+            'countMin': {
+                'width': cms.width,
+                'depth': cms.depth,
+                'epsilon': round(cms.epsilon, 6),
+                'delta': round(cms.delta, 6),
+                'totalEvents': total,
+                'maxOvercount': math.ceil(cms.epsilon * total),
+                'memoryBytes': self.counts.memory_bytes
+            },
+            'hyperLogLog': {
+                'precision': hll.precision,
+                'registers': len(hll.registers),
+                'standardError': round(hll.standard_error, 6),
+                'uniqueSearchers': self.unique_searchers(),
+                'memoryBytes': self.searchers.memory_bytes
+            },
+            'memoryBytes': self.counts.memory_bytes + self.searchers.memory_bytes
+        }
+
+    def snapshot(self) -> Dict:
+        return {'counts': self.counts.to_dict(), 'searchers': self.searchers.to_dict()}
+
+    def merge_snapshot(self, data: Dict):
+        """Fold another worker's snapshot into this one"""
+        try:
+            counts = self.counts.load(data['counts'])
+            searchers = self.searchers.load(data['searchers'])
+        except (KeyError, TypeError, OverflowError) as e:
+            raise ValueError("Malformed search sketch snapshot") from e
+
+        # Both windows are validated before either is modified
+        self.counts.check_compatible(counts)
+        self.searchers.check_compatible(searchers)
+        self.counts.merge(counts)
+        self.searchers.merge(searchers)
+
+search_traffic = SearchTrafficMonitor(
+    window_seconds=SEARCH_WINDOW_SECONDS,
+    width=SEARCH_SKETCH_WIDTH,
+    depth=SEARCH_SKETCH_DEPTH,
+    precision=SEARCH_HLL_PRECISION
+)
+
+# Window search counts per flight that raise the demand level to at least this tier
+SEARCH_DEMAND_THRESHOLDS = [(300, 'surge'), (100, 'high'), (25, 'medium')]
+DEMAND_RANK = {'low': 0, 'medium': 1, 'high': 2, 'surge': 3}
+
+def search_demand_level(search_count: int) -> str:
+    """Map observed search volume to a demand level"""
+    for threshold, level in SEARCH_DEMAND_THRESHOLDS:
+        if search_count >= threshold:
+            return level
+    return 'low'
+
 # Mock events database
 def initialize_events():
     events_db.update({
@@ -138,7 +674,7 @@ def initialize_events():
         }
     })
 
-def detect_fraud_activity(flight_id: str, user_id: str, search_count: int) -> Dict:
+def detect_fraud_activity(flight_id: str, user_id: str, search_count: int, record: bool = True) -> Dict:
     """Fraud and abuse detection"""
     alerts = []
 
@@ -150,7 +686,7 @@ def detect_fraud_activity(flight_id: str, user_id: str, search_count: int) -> Di
     if flight_id in fraud_alerts and any(alert['userId'] == user_id for alert in fraud_alerts):
         alerts.append("Repeated suspicious activity from same user")
 
-    if alerts:
+    if alerts and record:
         fraud_alerts.append({
             'flightId': flight_id,
             'userId': user_id,
@@ -160,9 +696,11 @@ def detect_fraud_activity(flight_id: str, user_id: str, search_count: int) -> Di
 
     return {'alerts': alerts, 'severity': len(alerts)}
 
-def calculate_explainable_price(request: PriceRequest) -> dict:
+def calculate_explainable_price(request: PriceRequest, hypothetical: bool = False) -> dict:
     """
-    Advanced explainable dynamic pricing algorithm with detailed breakdown
+    Advanced explainable dynamic pricing algorithm with detailed breakdown.
+    Hypothetical quotes leave demand state, fraud alerts and price history
+    untouched.
     """
     flight_id = request.flightId
     base_fare = request.baseFare
@@ -184,11 +722,11 @@ def calculate_explainable_price(request: PriceRequest) -> dict:
     hours_until_departure = (departure - now).total_seconds() / 3600
 
     # Initialize price history for this flight
-    if flight_id not in price_history:
+    if not hypothetical and flight_id not in price_history:
         price_history[flight_id] = []
 
     # Fraud detection
-    fraud_info = detect_fraud_activity(flight_id, user_id, search_count)
+    fraud_info = detect_fraud_activity(flight_id, user_id, search_count, record=not hypothetical)
 
     # 1. Seat availability factor (with flight-specific variation)
     seat_percentage = (available_seats / total_seats) * 100
@@ -239,18 +777,23 @@ def calculate_explainable_price(request: PriceRequest) -> dict:
     time_impact = (time_multiplier - 1) * base_fare
 
     # Initialize demand levels with more variation
-    if flight_id not in demand_levels:
+    demand_info = demand_levels.get(flight_id)
+    if demand_info is None:
         # Use flight_id hash to create deterministic but varied demand levels
         flight_hash = hash(flight_id) % 1000
         base_level = ['low', 'medium', 'high'][flight_hash % 3]
-        demand_levels[flight_id] = {
+        demand_info = {
             'level': base_level,
             'booking_count': random.randint(10, 50) + (flight_hash % 20),
             'spike_probability': 0.1 + (flight_hash % 50) / 100,  # 0.1 to 0.6
             'trend': random.choice(['increasing', 'stable', 'decreasing'])
         }
+        if not hypothetical:
+            demand_levels[flight_id] = demand_info
 
-    demand_info = demand_levels[flight_id]
+    if hypothetical:
+        # Spikes below update a private copy so the live demand state is unchanged
+        demand_info = dict(demand_info)
 
     # Simulate demand spikes with flight-specific variation
     seat_factor = available_seats / total_seats
@@ -260,13 +803,19 @@ def calculate_explainable_price(request: PriceRequest) -> dict:
         demand_info['level'] = random.choice(['high', 'surge'])
         demand_info['booking_count'] += random.randint(5, 15)
 
+    # Observed search volume can raise the simulated level for this quote only,
+    # so it falls back once the searches age out of the window
+    observed_searches = search_traffic.flight_searches(flight_id)
+    observed_level = search_demand_level(observed_searches)
+    demand_level = max(demand_info['level'], observed_level, key=lambda level: DEMAND_RANK.get(level, 0))
+
     demand_multipliers = {
         'low': 0.9,
         'medium': 1.0,
         'high': 1.3,
         'surge': 1.7
     }
-    demand_multiplier = demand_multipliers.get(demand_info['level'], 1.0)
+    demand_multiplier = demand_multipliers.get(demand_level, 1.0)
     demand_impact = (demand_multiplier - 1) * base_fare
 
     # 4. User behavior factor
@@ -342,8 +891,9 @@ def calculate_explainable_price(request: PriceRequest) -> dict:
                 'factor': 'Demand Level',
                 'multiplier': round(demand_multiplier, 2),
                 'impact': round(demand_impact, 2),
-                'reason': f"Current demand: {demand_info['level'].title()} - {demand_info['booking_count']} bookings",
-                'level': demand_info['level']
+                'reason': f"Current demand: {demand_level.title()} - {demand_info['booking_count']} bookings, {observed_searches} recent searches",
+                'level': demand_level,
+                'searches': observed_searches
             },
             {
                 'factor': 'User Behavior',
@@ -370,20 +920,22 @@ def calculate_explainable_price(request: PriceRequest) -> dict:
     # Remove zero-impact factors for cleaner output
     explanation['breakdown'] = [item for item in explanation['breakdown'] if abs(item['impact']) > 0.01]
 
-    # Store price history
-    price_history[flight_id].append({
-        'timestamp': datetime.now().isoformat(),
-        'price': round(final_price, 2),
-        'multiplier': round(final_multiplier, 2),
-        'factors': explanation['breakdown']
-    })
+    if not hypothetical:
+        # Store price history
+        price_history[flight_id].append({
+            'timestamp': datetime.now().isoformat(),
+            'price': round(final_price, 2),
+            'multiplier': round(final_multiplier, 2),
+            'demandLevel': demand_level,
+            'factors': explanation['breakdown']
+        })
 
-    # Keep only last 30 days of history
-    cutoff_date = datetime.now() - timedelta(days=30)
-    price_history[flight_id] = [
-        entry for entry in price_history[flight_id]
-        if datetime.fromisoformat(entry['timestamp']) > cutoff_date
-    ]
+        # Keep only last 30 days of history
+        cutoff_date = datetime.now() - timedelta(days=30)
+        price_history[flight_id] = [
+            entry for entry in price_history[flight_id]
+            if datetime.fromisoformat(entry['timestamp']) > cutoff_date
+        ]
 
     # Generate forecast if available
     forecast = None
@@ -393,7 +945,7 @@ def calculate_explainable_price(request: PriceRequest) -> dict:
     return {
         'price': round(final_price, 2),
         'multiplier': round(final_multiplier, 2),
-        'demandLevel': demand_info['level'],
+        'demandLevel': demand_level,
         'bookingCount': demand_info['booking_count'],
         'explanation': explanation,
         'forecast': forecast,
@@ -429,6 +981,7 @@ async def calculate_price(request: PriceRequest):
     """
     try:
         print(f"🔢 Calculating price for flight {request.flightId}: baseFare={request.baseFare}, availableSeats={request.availableSeats}/{request.totalSeats}")
+        search_traffic.record_search(request.flightId, searcher_id=request.searcherId or request.userId)
         result = calculate_explainable_price(request)
         print(f"💰 Final price for flight {request.flightId}: ${result['price']:.2f} (multiplier: {result['multiplier']:.2f})")
         return PriceResponse(
@@ -464,6 +1017,73 @@ async def get_price_history(flight_id: str, days: int = 30):
         'totalEntries': len(history)
     }
 
+@app.get('/api/price/export')
+async def export_price_history(
+    flightId: Optional[List[str]] = Query(None),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    demandLevel: Optional[DemandLevel] = None,
+    format: str = 'ndjson',
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1)
+):
+    """
+    Stream price points across flights as NDJSON or CSV for offline analysis
+    """
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {format}")
+
+    try:
+        start_time = parse_export_time(start) if start else None
+        end_time = parse_export_time(end) if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO 8601 timestamps")
+
+    try:
+        resume_from = decode_export_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid export cursor")
+
+    rows = iter_price_points(
+        flight_ids=flightId,
+        start_time=start_time,
+        end_time=end_time,
+        demand_level=demandLevel.value if demandLevel else None,
+        resume_from=resume_from,
+        limit=limit
+    )
+    chunks = csv_export_chunks(rows) if format == 'csv' else ndjson_export_chunks(rows)
+
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="price_history.{format}"'}
+    )
+
+@app.post('/api/price/refresh')
+async def refresh_prices(request: PriceRefreshRequest):
+    """
+    Re-price many flights from their current booking backend records
+    """
+    try:
+        flights = await flight_data_client.get_flights(request.flightIds)
+    except httpx.HTTPError as e:
+        raise booking_backend_error(e, ','.join(request.flightIds))
+
+    prices = {}
+    for flight_id, flight_record in flights.items():
+        result = calculate_explainable_price(PriceRequest(**pricing_fields(flight_record)))
+        prices[flight_id] = {
+            'price': result['price'],
+            'multiplier': result['multiplier'],
+            'demandLevel': result['demandLevel']
+        }
+
+    return {
+        'prices': prices,
+        'missing': [flight_id for flight_id in dict.fromkeys(request.flightIds) if flight_id not in flights]
+    }
+
 @app.get('/api/forecast/{flight_id}')
 async def get_demand_forecast(flight_id: str):
     """
@@ -481,38 +1101,50 @@ async def what_if_scenario(scenario: WhatIfScenario):
     """
     What-if pricing simulator
     """
-    flight_id = scenario.scenario
+    flight_id = scenario.flightId
     scenario_type = scenario.scenario
     value = scenario.value
 
-    # Mock current flight data (in real system, fetch from database)
-    mock_flight = {
-        'flightId': flight_id,
-        'baseFare': 4500,
-        'totalSeats': 150,
-        'availableSeats': 75,
-        'departureTime': (datetime.now() + timedelta(days=7)).isoformat()
-    }
+    if not is_flight_id(flight_id):
+        raise HTTPException(status_code=400, detail=f"Invalid flight id: {flight_id}")
+
+    try:
+        flight_record = await flight_data_client.get_flight(flight_id)
+    except httpx.HTTPError as e:
+        raise booking_backend_error(e, flight_id)
+
+    if flight_record is None:
+        raise HTTPException(status_code=404, detail=f"Flight {flight_id} not found")
+
+    flight = pricing_fields(flight_record)
+
+    # Price the unmodified flight and the scenario from the same random draws,
+    # so the difference reflects the scenario rather than simulation noise
+    random_state = random.getstate()
+    original = calculate_explainable_price(PriceRequest(**flight), hypothetical=True)
+    original_price = original['price']
+    random.setstate(random_state)
 
     # Apply scenario modifications
     if scenario_type == 'fuel_increase':
-        mock_flight['baseFare'] *= (1 + value/100)  # value is percentage increase
+        flight['baseFare'] *= (1 + value/100)  # value is percentage increase
     elif scenario_type == 'half_empty':
-        mock_flight['availableSeats'] = mock_flight['totalSeats'] // 2
+        flight['availableSeats'] = flight['totalSeats'] // 2
     elif scenario_type == 'competitor_price_drop':
         # Simulate competitive response
-        mock_flight['baseFare'] *= (1 - value/100)
+        flight['baseFare'] *= (1 - value/100)
 
     # Calculate new price with scenario
-    request = PriceRequest(**mock_flight)
-    result = calculate_explainable_price(request)
+    request = PriceRequest(**flight)
+    result = calculate_explainable_price(request, hypothetical=True)
 
     return {
         'scenario': scenario_type,
-        'originalPrice': 4500,  # Mock original
+        'flightId': flight['flightId'],
+        'originalPrice': original_price,
         'newPrice': result['price'],
-        'change': result['price'] - 4500,
-        'changePercent': ((result['price'] - 4500) / 4500) * 100,
+        'change': result['price'] - original_price,
+        'changePercent': ((result['price'] - original_price) / original_price) * 100,
         'explanation': result['explanation']
     }
 
@@ -523,6 +1155,52 @@ async def get_events():
     """
     return {'events': list(events_db.values())}
 
+@app.get('/api/search-sketches')
+async def get_search_sketches(flightId: Optional[str] = None, origin: Optional[str] = None,
+                              destination: Optional[str] = None):
+    """
+    Search traffic sketch estimates, error bounds and memory footprint
+    """
+    stats = search_traffic.stats()
+    if flightId:
+        stats['flightSearches'] = search_traffic.flight_searches(flightId)
+    if origin and destination:
+        stats['routeSearches'] = search_traffic.route_searches(origin, destination)
+    return stats
+
+@app.post('/api/search-events')
+async def record_search_event(event: SearchEvent):
+    """
+    Record one route search from the booking backend
+    """
+    search_traffic.record_route_search(event.origin, event.destination, searcher_id=event.searcherId)
+    return {'routeSearches': search_traffic.route_searches(event.origin, event.destination)}
+
+def require_sketch_token(x_internal_token: Optional[str] = Header(None)):
+    """Only workers holding SKETCH_MERGE_TOKEN may exchange raw sketches"""
+    if not SKETCH_MERGE_TOKEN:
+        raise HTTPException(status_code=403, detail="Sketch exchange is disabled")
+    if not x_internal_token or not hmac.compare_digest(x_internal_token, SKETCH_MERGE_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid internal token")
+
+@app.get('/api/search-sketches/snapshot', dependencies=[Depends(require_sketch_token)])
+async def get_search_sketch_snapshot():
+    """
+    Serialized sketches so another worker can merge them
+    """
+    return search_traffic.snapshot()
+
+@app.post('/api/search-sketches/merge', dependencies=[Depends(require_sketch_token)])
+async def merge_search_sketches(snapshot: Dict):
+    """
+    Merge another worker's search sketch snapshot into this one
+    """
+    try:
+        search_traffic.merge_snapshot(snapshot)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return search_traffic.stats()
+
 @app.get('/api/fraud-alerts')
 async def get_fraud_alerts():
     """
@@ -662,6 +1340,100 @@ def calculate_missed_revenue(history: List[Dict]) -> Dict:
         'opportunities': len([p for p in prices if p < avg_price * 0.8])
     }
 
+EXPORT_FIELDS = ['flightId', 'timestamp', 'price', 'multiplier', 'demandLevel', 'cursor']
+EXPORT_MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_BATCH_SIZE = 500  # Rows per streamed chunk
+
+def parse_export_time(value: str) -> datetime:
+    """Parse an ISO timestamp into the naive local form used by price history"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        # Convert to local time before dropping the offset, as history timestamps are local
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+def encode_export_cursor(flight_id: str, timestamp: str) -> str:
+    """Encode the position of an exported price point as an opaque cursor"""
+    raw = json.dumps([flight_id, timestamp]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_export_cursor(cursor: str) -> tuple:
+    """Decode an export cursor into (flight_id, timestamp)"""
+    try:
+        flight_id, timestamp = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(flight_id), parse_export_time(timestamp)
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid export cursor: {cursor}") from e
+
+def iter_price_points(flight_ids: Optional[List[str]] = None, start_time: Optional[datetime] = None,
+                      end_time: Optional[datetime] = None, demand_level: Optional[str] = None,
+                      resume_from: Optional[tuple] = None, limit: Optional[int] = None):
+    """
+    Lazily yield filtered price points, ordered by flight id then timestamp.
+    Only the flight id list is snapshotted, so memory stays flat however large
+    the history grows.
+    """
+    flights = sorted(set(flight_ids)) if flight_ids else sorted(list(price_history))
+    emitted = 0
+
+    for flight_id in flights:
+        if resume_from and flight_id < resume_from[0]:
+            continue
+
+        for entry in price_history.get(flight_id, []):
+            timestamp = datetime.fromisoformat(entry['timestamp'])
+
+            if resume_from and flight_id == resume_from[0] and timestamp <= resume_from[1]:
+                continue
+            if start_time and timestamp < start_time:
+                continue
+            if end_time and timestamp > end_time:
+                continue
+            if demand_level and entry.get('demandLevel') != demand_level:
+                continue
+
+            yield {
+                'flightId': flight_id,
+                'timestamp': entry['timestamp'],
+                'price': entry['price'],
+                'multiplier': entry['multiplier'],
+                'demandLevel': entry.get('demandLevel'),
+                'cursor': encode_export_cursor(flight_id, entry['timestamp'])
+            }
+
+            emitted += 1
+            if limit and emitted >= limit:
+                return
+
+def ndjson_export_chunks(rows):
+    """Serialize export rows as newline-delimited JSON in batches"""
+    batch = []
+    for row in rows:
+        batch.append(json.dumps(row))
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield '\n'.join(batch) + '\n'
+            batch = []
+    if batch:
+        yield '\n'.join(batch) + '\n'
+
+def csv_export_chunks(rows):
+    """Serialize export rows as CSV in batches, reusing a single buffer"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    pending = 0
+
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+
+    yield buffer.getvalue()
+
 def simulate_demand_updates():
     """
     Enhanced background task with advanced simulations
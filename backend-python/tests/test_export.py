@@ -0,0 +1,120 @@
+import base64
+import csv
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+
+
+def make_cursor(flight_id, timestamp):
+    return base64.urlsafe_b64encode(json.dumps([flight_id, timestamp]).encode()).decode()
+
+
+def seed_history(flight_id, timestamps, levels=None):
+    levels = levels or ['medium'] * len(timestamps)
+    main.price_history[flight_id] = [
+        {'timestamp': ts.isoformat(), 'price': 4500.0, 'multiplier': 1.0, 'demandLevel': level, 'factors': []}
+        for ts, level in zip(timestamps, levels)
+    ]
+
+
+def export_rows(**params):
+    response = client.get('/api/price/export', params=params)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_parse_export_time_converts_offset_to_local():
+    instant = datetime(2026, 1, 1, 12, 0, tzinfo=timezone(timedelta(hours=5, minutes=30)))
+    assert main.parse_export_time(instant.isoformat()) == instant.astimezone().replace(tzinfo=None)
+
+
+def test_cursor_with_utc_offset_resumes_after_entry():
+    now = datetime.now()
+    seed_history('export-tz', [now - timedelta(minutes=2), now - timedelta(minutes=1)])
+
+    first = now - timedelta(minutes=2)
+    cursor = make_cursor('export-tz', first.astimezone(timezone.utc).isoformat())
+    response = client.get('/api/price/export', params={'flightId': 'export-tz', 'cursor': cursor})
+
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row['timestamp'] for row in rows] == [(now - timedelta(minutes=1)).isoformat()]
+
+
+def test_malformed_cursor_is_rejected():
+    response = client.get('/api/price/export', params={'cursor': make_cursor('export-tz', 5)})
+    assert response.status_code == 400
+
+
+def test_export_orders_by_flight_then_timestamp():
+    now = datetime.now()
+    seed_history('export-b', [now - timedelta(minutes=3), now - timedelta(minutes=1)])
+    seed_history('export-a', [now - timedelta(minutes=2)])
+
+    rows = export_rows(flightId=['export-b', 'export-a'])
+
+    assert [(row['flightId'], row['timestamp']) for row in rows] == [
+        ('export-a', (now - timedelta(minutes=2)).isoformat()),
+        ('export-b', (now - timedelta(minutes=3)).isoformat()),
+        ('export-b', (now - timedelta(minutes=1)).isoformat()),
+    ]
+
+
+def test_export_filters_by_demand_level_and_time_range():
+    now = datetime.now()
+    timestamps = [now - timedelta(hours=hours) for hours in (4, 3, 2, 1)]
+    seed_history('export-filter', timestamps, ['high', 'surge', 'high', 'low'])
+
+    high = export_rows(flightId='export-filter', demandLevel='high')
+    assert [row['timestamp'] for row in high] == [timestamps[0].isoformat(), timestamps[2].isoformat()]
+
+    ranged = export_rows(flightId='export-filter',
+                         start=(now - timedelta(hours=3, minutes=30)).isoformat(),
+                         end=(now - timedelta(hours=1, minutes=30)).isoformat())
+    assert [row['demandLevel'] for row in ranged] == ['surge', 'high']
+
+
+def test_export_limit_and_cursor_page_through_everything():
+    now = datetime.now()
+    seed_history('export-page-a', [now - timedelta(minutes=m) for m in (5, 4, 3)])
+    seed_history('export-page-b', [now - timedelta(minutes=m) for m in (2, 1)])
+    flights = ['export-page-a', 'export-page-b']
+    expected = export_rows(flightId=flights)
+
+    pages, cursor = [], None
+    while True:
+        params = {'flightId': flights, 'limit': 2}
+        if cursor:
+            params['cursor'] = cursor
+        page = export_rows(**params)
+        if not page:
+            break
+        assert len(page) <= 2
+        pages.extend(page)
+        cursor = page[-1]['cursor']
+
+    assert len(expected) == 5
+    assert pages == expected
+
+
+def test_export_csv():
+    now = datetime.now()
+    seed_history('export-csv', [now - timedelta(minutes=1)], ['surge'])
+
+    response = client.get('/api/price/export', params={'flightId': 'export-csv', 'format': 'csv'})
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/csv')
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert list(rows[0]) == main.EXPORT_FIELDS
+    assert [(row['flightId'], row['price'], row['demandLevel']) for row in rows] == [('export-csv', '4500.0', 'surge')]
+
+
+def test_export_rejects_unknown_format():
+    assert client.get('/api/price/export', params={'format': 'xml'}).status_code == 400
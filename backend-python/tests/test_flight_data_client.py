@@ -0,0 +1,166 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+
+import main
+
+KNOWN_ID = '64b7f0c2a1b2c3d4e5f60718'
+OTHER_ID = '64b7f0c2a1b2c3d4e5f60719'
+UNKNOWN_ID = '64b7f0c2a1b2c3d4e5f6071a'
+
+
+def make_stand_in(known_ids, delay=0.05):
+    """Booking backend stand-in that counts upstream calls per path"""
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.path)
+        await asyncio.sleep(delay)
+        flight_id = request.url.path.rsplit('/', 1)[-1]
+        if known_ids is not None and flight_id not in known_ids:
+            return httpx.Response(404, json={'message': 'Flight not found'})
+        return httpx.Response(200, json={
+            '_id': flight_id,
+            'flightNumber': 'AI101',
+            'origin': {'iata': 'DEL'},
+            'destination': {'iata': 'BOM'},
+            'baseFare': 4500,
+            'totalSeats': 150,
+            'availableSeats': ['1A', '1B', '1C'],
+            'departureTime': (datetime.now() + timedelta(days=7)).isoformat()
+        })
+
+    return httpx.MockTransport(handler), calls
+
+
+def make_client(known_ids, ttl=60):
+    transport, calls = make_stand_in(known_ids)
+    return main.FlightDataClient('http://booking.test/api', ttl=ttl, transport=transport), calls
+
+
+def test_concurrent_lookups_share_one_upstream_call():
+    async def scenario():
+        client, calls = make_client({KNOWN_ID})
+        records = await asyncio.gather(*(client.get_flight(KNOWN_ID) for _ in range(10)))
+        await client.close()
+        return records, calls
+
+    records, calls = asyncio.run(scenario())
+
+    assert calls == [f'/api/flights/{KNOWN_ID}']
+    assert all(record == records[0] for record in records)
+    assert records[0]['availableSeats'] == 3
+    assert records[0]['origin'] == 'DEL'
+
+
+def test_cached_record_expires_after_ttl():
+    async def scenario():
+        client, calls = make_client({KNOWN_ID}, ttl=0.1)
+        await client.get_flight(KNOWN_ID)
+        await client.get_flight(KNOWN_ID)
+        cached_calls = len(calls)
+        await asyncio.sleep(0.15)
+        await client.get_flight(KNOWN_ID)
+        await client.close()
+        return cached_calls, len(calls)
+
+    assert asyncio.run(scenario()) == (1, 2)
+
+
+def test_unknown_flight_returns_none():
+    async def scenario():
+        client, calls = make_client(set())
+        record = await client.get_flight(UNKNOWN_ID)
+        await client.close()
+        return record, calls
+
+    record, calls = asyncio.run(scenario())
+    assert record is None
+    assert calls == [f'/api/flights/{UNKNOWN_ID}']
+
+
+def test_malformed_id_never_reaches_backend():
+    async def scenario():
+        client, calls = make_client({KNOWN_ID})
+        record = await client.get_flight('a/../../admin')
+        await client.close()
+        return record, calls
+
+    assert asyncio.run(scenario()) == (None, [])
+
+
+def test_get_flights_leaves_out_unknown_ids():
+    async def scenario():
+        client, calls = make_client({KNOWN_ID, OTHER_ID})
+        records = await client.get_flights([KNOWN_ID, UNKNOWN_ID, OTHER_ID, KNOWN_ID])
+        await client.close()
+        return records, calls
+
+    records, calls = asyncio.run(scenario())
+    assert set(records) == {KNOWN_ID, OTHER_ID}
+    assert len(calls) == 3
+
+
+def test_what_if_compares_against_dynamic_price_without_touching_state(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    transport, _ = make_stand_in({KNOWN_ID}, delay=0)
+    monkeypatch.setattr(main, 'flight_data_client',
+                        main.FlightDataClient('http://booking.test/api', transport=transport))
+    demand_before = dict(main.demand_levels)
+    alerts_before = list(main.fraud_alerts)
+
+    with TestClient(main.app) as client:
+        response = client.post('/api/what-if', json={'scenario': 'fuel_increase', 'value': 10, 'flightId': KNOWN_ID})
+        rejected = client.post('/api/what-if', json={'scenario': 'fuel_increase', 'value': 10, 'flightId': 'a/../../admin'})
+
+    assert response.status_code == 200
+    assert abs(response.json()['changePercent'] - 10) < 1
+    assert rejected.status_code == 400
+    assert main.demand_levels == demand_before
+    assert main.fraud_alerts == alerts_before
+    assert KNOWN_ID not in main.price_history
+
+
+def test_cache_drops_expired_entries_and_stays_bounded():
+    async def scenario():
+        transport, _ = make_stand_in(None, delay=0)
+        client = main.FlightDataClient('http://booking.test/api', ttl=60, max_cached=3, transport=transport)
+        ids = [f'{i:024x}' for i in range(5)]
+        for flight_id in ids:
+            await client.get_flight(flight_id)
+        await client.close()
+        return client, ids
+
+    client, ids = asyncio.run(scenario())
+    assert list(client._cache) == ids[-3:]
+
+
+def test_what_if_reports_upstream_failures_without_claiming_missing_flight(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    for upstream_status, expected in ((429, 503), (403, 502), (500, 502)):
+        transport = httpx.MockTransport(lambda request, status=upstream_status: httpx.Response(status))
+        monkeypatch.setattr(main, 'flight_data_client',
+                            main.FlightDataClient('http://booking.test/api', transport=transport))
+        with TestClient(main.app) as client:
+            response = client.post('/api/what-if', json={'scenario': 'half_empty', 'value': 0, 'flightId': KNOWN_ID})
+        assert response.status_code == expected
+
+
+def test_price_refresh_prices_known_flights_in_bulk(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    transport, calls = make_stand_in({KNOWN_ID, OTHER_ID}, delay=0)
+    monkeypatch.setattr(main, 'flight_data_client',
+                        main.FlightDataClient('http://booking.test/api', transport=transport))
+
+    with TestClient(main.app) as client:
+        response = client.post('/api/price/refresh', json={'flightIds': [KNOWN_ID, UNKNOWN_ID, OTHER_ID, 'bad']})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body['prices']) == {KNOWN_ID, OTHER_ID}
+    assert body['missing'] == [UNKNOWN_ID, 'bad']
+    assert len(calls) == 3
@@ -0,0 +1,179 @@
+from collections import Counter
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_count_min_never_undercounts_and_stays_within_bound():
+    sketch = main.CountMinSketch(width=256, depth=4)
+    truth = Counter(f'flight:{i % 997}' for i in range(20000))
+    for key, count in truth.items():
+        sketch.add(key, count)
+
+    bound = sketch.epsilon * sketch.total
+    within_bound = 0
+    for key, count in truth.items():
+        estimate = sketch.estimate(key)
+        assert estimate >= count
+        within_bound += estimate - count <= bound
+    # The bound holds per key with probability 1 - delta
+    assert within_bound / len(truth) >= 1 - sketch.delta
+
+
+def test_hyperloglog_error_within_bound_at_precision_12():
+    for cardinality in (500, 10000, 100000):
+        sketch = main.HyperLogLog(precision=12)
+        for i in range(cardinality):
+            sketch.add(f'user-{i}')
+        relative_error = abs(sketch.count() - cardinality) / cardinality
+        assert relative_error <= 3 * sketch.standard_error
+
+
+def test_hyperloglog_small_precision_uses_standard_constants():
+    sketch = main.HyperLogLog(precision=4)
+    for i in range(2000):
+        sketch.add(f'user-{i}')
+    assert abs(sketch.count() - 2000) / 2000 <= 3 * sketch.standard_error
+
+
+def test_window_buckets_expire():
+    window = main.SlidingWindowSketch(lambda: main.CountMinSketch(64, 2), window_seconds=60, buckets=6)
+    start = 1_000_000.0
+    window.current(start).add('flight:a')
+    window.current(start + 30).add('flight:a')
+
+    assert sum(s.estimate('flight:a') for s in window.live(start + 30)) == 2
+    assert sum(s.estimate('flight:a') for s in window.live(start + 65)) == 1
+    assert sum(s.estimate('flight:a') for s in window.live(start + 100)) == 0
+
+
+def test_snapshot_merge_combines_workers():
+    worker_a = main.SearchTrafficMonitor(width=256, depth=4, precision=10)
+    worker_b = main.SearchTrafficMonitor(width=256, depth=4, precision=10)
+    for i in range(30):
+        worker_a.record_search('f1', searcher_id=f'a{i}')
+        worker_a.record_route_search('DEL', 'BOM', searcher_id=f'a{i}')
+    for i in range(20):
+        worker_b.record_search('f1', searcher_id=f'b{i}')
+        worker_b.record_route_search('del', 'bom', searcher_id=f'b{i}')
+
+    worker_a.merge_snapshot(worker_b.snapshot())
+
+    assert worker_a.flight_searches('f1') == 50
+    assert worker_a.route_searches('DEL', 'BOM') == 50
+    assert abs(worker_a.unique_searchers() - 50) <= 3
+
+
+def test_route_counted_once_per_search_not_per_quote():
+    client = TestClient(main.app)
+    before = main.search_traffic.route_searches('GOI', 'PNQ')
+
+    client.post('/api/search-events', json={'origin': 'goi', 'destination': 'pnq', 'searcherId': '10.0.0.1'})
+    for flight_id in ('route-f1', 'route-f2', 'route-f3', 'route-f4'):
+        main.search_traffic.record_search(flight_id, searcher_id='10.0.0.1')
+
+    assert main.search_traffic.route_searches('GOI', 'PNQ') == before + 1
+
+
+def test_rejected_merge_leaves_local_state_untouched():
+    monitor = main.SearchTrafficMonitor(width=256, depth=4, precision=10)
+    monitor.record_search('f1', searcher_id='u1')
+    foreign = main.SearchTrafficMonitor(width=128, depth=4, precision=10)
+    foreign.record_search('f2', searcher_id='u2')
+    snapshot = foreign.snapshot()
+    # Counts match this worker but the HyperLogLog layout does not
+    snapshot['counts'] = main.SearchTrafficMonitor(width=256, depth=4, precision=10).snapshot()['counts']
+    snapshot['searchers'] = main.SearchTrafficMonitor(width=256, depth=4, precision=8).snapshot()['searchers']
+
+    for payload in (foreign.snapshot(), snapshot):
+        try:
+            monitor.merge_snapshot(payload)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("merge should have been rejected")
+
+    assert monitor.flight_searches('f1') == 1
+    assert monitor.unique_searchers() == 1
+
+
+TOKEN_HEADERS = {'X-Internal-Token': 'worker-secret'}
+
+
+def test_sketch_exchange_requires_internal_token(monkeypatch):
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, 'SKETCH_MERGE_TOKEN', None)
+    assert client.get('/api/search-sketches/snapshot').status_code == 403
+
+    monkeypatch.setattr(main, 'SKETCH_MERGE_TOKEN', 'worker-secret')
+    assert client.get('/api/search-sketches/snapshot').status_code == 403
+    assert client.post('/api/search-sketches/merge', json={},
+                       headers={'X-Internal-Token': 'guess'}).status_code == 403
+    assert client.get('/api/search-sketches/snapshot', headers=TOKEN_HEADERS).status_code == 200
+
+
+def test_merge_endpoint_rejects_oversized_layout_before_allocating(monkeypatch):
+    monkeypatch.setattr(main, 'SKETCH_MERGE_TOKEN', 'worker-secret')
+    client = TestClient(main.app)
+    snapshot = client.get('/api/search-sketches/snapshot', headers=TOKEN_HEADERS).json()
+    for sketch in snapshot['counts']['sketches']:
+        sketch['width'] = 2 ** 40
+
+    response = client.post('/api/search-sketches/merge', json=snapshot, headers=TOKEN_HEADERS)
+    assert response.status_code == 400
+
+
+def test_merge_rejects_future_epochs_and_inconsistent_counts():
+    source = main.SearchTrafficMonitor(width=64, depth=2, precision=8)
+    source.record_search('f1', searcher_id='u1')
+
+    future = source.snapshot()
+    future['counts']['epochs'] = [10 ** 12] * len(future['counts']['epochs'])
+
+    inflated = source.snapshot()
+    for sketch in inflated['counts']['sketches']:
+        table = main.array('I', [300] * (64 * 2))
+        sketch['table'] = main.pack_array(table)
+
+    for payload in (future, inflated):
+        target = main.SearchTrafficMonitor(width=64, depth=2, precision=8)
+        try:
+            target.merge_snapshot(payload)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("merge should have been rejected")
+        assert target.flight_searches('f1') == 0
+
+
+def test_counters_saturate_instead_of_overflowing():
+    sketch = main.CountMinSketch(width=16, depth=2)
+    sketch.add('flight:a', main.CMS_MAX_COUNT - 1)
+    other = main.CountMinSketch(width=16, depth=2)
+    other.add('flight:a', 10)
+
+    sketch.merge(other)
+    sketch.add('flight:a', 5)
+
+    assert sketch.estimate('flight:a') == main.CMS_MAX_COUNT
+
+
+def test_observed_demand_does_not_stick_after_window(monkeypatch):
+    from datetime import datetime, timedelta
+
+    monitor = main.SearchTrafficMonitor()
+    monkeypatch.setattr(main, 'search_traffic', monitor)
+    flight_id = 'sticky-demand'
+    main.demand_levels[flight_id] = {'level': 'low', 'booking_count': 10, 'spike_probability': 0, 'trend': 'stable'}
+    monkeypatch.setattr(main.random, 'random', lambda: 0.99)  # Never spike
+    request = main.PriceRequest(flightId=flight_id, baseFare=4000, totalSeats=100, availableSeats=60,
+                                departureTime=(datetime.now() + timedelta(days=10)).isoformat())
+
+    for _ in range(300):
+        monitor.record_search(flight_id)
+    assert main.calculate_explainable_price(request)['demandLevel'] == 'surge'
+    assert main.demand_levels[flight_id]['level'] == 'low'
+
+    monkeypatch.setattr(main, 'search_traffic', main.SearchTrafficMonitor())
+    assert main.calculate_explainable_price(request)['demandLevel'] == 'low'